@@ -3,14 +3,24 @@ from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import asyncio
-import json
+import hashlib
+import re
 from datetime import datetime
 
+import orjson
+
 from rag_engine import RAGEngine
 from prompt_manager import PromptManager
 from cost_logger import CostLogger
+from token_counter import count_tokens, get_encoder, truncate_tokens
+from semantic_cache import SemanticResponseCache
+from retrieval_batcher import RetrievalBatcher
+from query_embedder import QueryEmbedder
+from retrieval_cache import RetrievalCache
+from pdf_extractor import PDFExtractor
+from summary_cache import SummaryCache
 
 app = FastAPI(title="Knowledge Copilot API")
 
@@ -24,15 +34,53 @@ app.add_middleware(
 )
 
 # Initialize components
+EMBEDDING_MODEL = "text-embedding-ada-002"
 rag_engine = RAGEngine(
-    embedding_model="text-embedding-ada-002",
+    embedding_model=EMBEDDING_MODEL,
     vector_db_type="faiss",  # or "chroma" or "pinecone"
     chunk_size=500,
     chunk_overlap=50
 )
 
+# Query embeddings for the response cache, in the engine's embedding space
+query_embedder = QueryEmbedder(model=EMBEDDING_MODEL)
+
+# Concurrent /chat requests share batched embedding and index search calls
+retrieval_batcher = RetrievalBatcher(rag_engine, query_embedder, window_ms=5.0, max_batch_size=64)
+# Exact repeats skip embedding and search entirely
+retrieval_cache = RetrievalCache(max_entries=4096, ttl_seconds=300)
+
+pdf_extractor = PDFExtractor(max_workers=8)
+
 prompt_manager = PromptManager(version="v1.2.0")
+# Static per prompt version; loaded once instead of per request
+SYSTEM_PROMPT = prompt_manager.get_system_prompt()
 cost_logger = CostLogger()
+response_cache = SemanticResponseCache(
+    similarity_threshold=0.92,
+    ttl_seconds=3600,
+    max_entries=1024
+)
+history_summaries = SummaryCache(max_entries=1024)
+
+# Streaming: tokens per SSE frame (amortizes per-yield overhead)
+STREAM_BATCH_TOKENS = 4
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+
+# Retrieved context above this many tokens is summarized first
+MAX_CONTEXT_TOKENS = 1000
+
+# History above this many tokens keeps its first and last turns verbatim
+# and has the turns in between summarized
+MAX_HISTORY_TOKENS = 1024
+HISTORY_KEEP_RECENT = 4
+
+# Fixed prompt and reply text, named in one place
+SUMMARY_PROMPT_PREFIX = "Summarize the following context concisely:\n\n"
+LOW_CONFIDENCE_RESPONSE = (
+    "I don't have enough context to answer that confidently. "
+    "Could you provide more details or rephrase your question?"
+)
 
 
 # Request/Response Models
@@ -61,6 +109,20 @@ class DocumentUploadResponse(BaseModel):
     status: str
 
 
+@app.on_event("startup")
+async def startup():
+    cost_logger.start_writer()
+    # First load may download the BPE file; keep that off the event loop
+    await asyncio.to_thread(get_encoder)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await retrieval_batcher.close()
+    await cost_logger.stop_writer()
+    pdf_extractor.close()
+
+
 # Endpoints
 @app.get("/")
 async def root():
@@ -80,7 +142,7 @@ async def upload_document(file: UploadFile = File(...)):
         
         # Process document based on type
         if file.filename.endswith('.pdf'):
-            text = await rag_engine.extract_text_from_pdf(content)
+            text = await pdf_extractor.extract_text(content)
         elif file.filename.endswith('.md'):
             text = content.decode('utf-8')
         elif file.filename.endswith('.txt'):
@@ -94,6 +156,10 @@ async def upload_document(file: UploadFile = File(...)):
             metadata={"filename": file.filename, "uploaded_at": datetime.now().isoformat()}
         )
         
+        # Cached answers may be stale against the new document set
+        response_cache.clear()
+        retrieval_cache.invalidate()
+        
         return DocumentUploadResponse(
             document_id=doc_id,
             filename=file.filename,
@@ -123,47 +189,77 @@ async def stream_chat_response(request: ChatRequest):
         # Extract latest user message
         user_message = request.messages[-1].content
         conversation_history = request.messages[:-1]
+        # Answers built while the document set changes must not be cached
+        docs_version = retrieval_cache.docs_version
+        
+        # Embed once; the vector serves the cache lookup and, on engines with
+        # batched search, the search itself
+        query_embedding, retrieval_results = await embed_query(user_message)
+        
+        # Serve paraphrases of answered questions without retrieval or LLM.
+        # Follow-ups depend on earlier turns, so only first turns are cached
+        use_cache = not conversation_history
+        cached = response_cache.lookup(query_embedding, request.model) if use_cache else None
+        if cached:
+            async for chunk in stream_text(cached["response"]):
+                yield sse_frame({"content": chunk})
+            
+            yield sse_frame({"metadata": {
+                "sources": cached["sources"],
+                "confidence": cached["confidence"],
+                "model": request.model,
+                "cached": True
+            }})
+            return
         
         # Log request start
         request_id = cost_logger.start_request(
             model=request.model,
             input_text=user_message
         )
-        
-        # Retrieve relevant context
-        retrieval_results = await rag_engine.retrieve(
-            query=user_message,
-            top_k=5,
-            confidence_threshold=0.7
-        )
-        
-        # Check if we have good enough context
-        if not retrieval_results or retrieval_results[0]['score'] < 0.7:
-            # Low confidence - ask clarifying question
-            clarification = await prompt_manager.get_clarification_prompt(
-                query=user_message,
-                available_docs=rag_engine.list_documents()
-            )
-            
-            async for chunk in stream_llm_response(clarification, request.model):
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
-            
-            cost_logger.end_request(request_id, output_text=clarification)
-            return
-        
-        # Build context-enhanced prompt
-        context = "\n\n".join([r['text'] for r in retrieval_results])
-        
-        # Check context size and summarize if needed
-        if len(context) > 4000:  # Token estimation
-            context = await summarize_context(context, request.model)
-        
-        # Get system prompt and construct final prompt
-        system_prompt = prompt_manager.get_system_prompt()
+
+        # History compression may call the LLM; overlap it with retrieval
+        history_task = asyncio.create_task(compress_history(conversation_history, request.model))
+        try:
+            # Retrieve relevant context
+            if retrieval_results is None:
+                retrieval_results = await retrieve_context(user_message, query_embedding)
+
+            # Check if we have good enough context
+            if not retrieval_results or retrieval_results[0]['score'] < 0.7:
+                history_task.cancel()
+
+                # Low confidence - ask clarifying question
+                clarification = await prompt_manager.get_clarification_prompt(
+                    query=user_message,
+                    available_docs=rag_engine.list_documents()
+                )
+
+                async for chunk in stream_llm_response(clarification, request.model):
+                    yield sse_frame({"content": chunk})
+
+                await asyncio.to_thread(cost_logger.end_request, request_id, output_text=clarification)
+                return
+
+            # Build context-enhanced prompt
+            chunks = unique_chunks(retrieval_results)
+            context = build_context(chunks)
+
+            # Check context size and summarize if needed
+            if await asyncio.to_thread(context_tokens, chunks) > MAX_CONTEXT_TOKENS:
+                context, history = await asyncio.gather(
+                    summarize_context(context, request.model), history_task
+                )
+            else:
+                history = await history_task
+        finally:
+            history_task.cancel()
+
+        # Construct final prompt
         final_prompt = prompt_manager.construct_prompt(
-            system=system_prompt,
+            system=SYSTEM_PROMPT,
             context=context,
-            conversation_history=conversation_history,
+            conversation_history=history,
             user_query=user_message
         )
         
@@ -171,67 +267,113 @@ async def stream_chat_response(request: ChatRequest):
         full_response = ""
         async for chunk in stream_llm_response(final_prompt, request.model):
             full_response += chunk
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
+            yield sse_frame({"content": chunk})
         
         # Send metadata
         metadata = {
-            "sources": [r['metadata']['filename'] for r in retrieval_results],
+            "sources": chunk_sources(chunks),
             "confidence": retrieval_results[0]['score'],
             "model": request.model,
             "processing_time": cost_logger.get_request_time(request_id)
         }
         
-        yield f"data: {json.dumps({'metadata': metadata})}\n\n"
+        yield sse_frame({"metadata": metadata})
         
         # Log cost
-        cost_logger.end_request(request_id, output_text=full_response)
+        # Counting tokens of a long response is CPU work; keep it off the loop
+        await asyncio.to_thread(cost_logger.end_request, request_id, output_text=full_response)
+        
+        if use_cache and retrieval_cache.docs_version == docs_version:
+            response_cache.store(
+                query=user_message,
+                model=request.model,
+                embedding=query_embedding,
+                response=full_response,
+                sources=metadata["sources"],
+                confidence=metadata["confidence"]
+            )
         
     except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        yield sse_frame({"error": str(e)})
 
 
 async def generate_chat_response(request: ChatRequest) -> ChatResponse:
     """Non-streaming chat response"""
     user_message = request.messages[-1].content
     conversation_history = request.messages[:-1]
+    # Answers built while the document set changes must not be cached
+    docs_version = retrieval_cache.docs_version
     
-    # Retrieve context
-    retrieval_results = await rag_engine.retrieve(
-        query=user_message,
-        top_k=5,
-        confidence_threshold=0.7
-    )
+    # Embed once; the vector serves the cache lookup and, on engines with
+    # batched search, the search itself
+    query_embedding, retrieval_results = await embed_query(user_message)
     
-    if not retrieval_results or retrieval_results[0]['score'] < 0.7:
-        # Low confidence response
-        response_text = f"I don't have enough context to answer that confidently. Could you provide more details or rephrase your question?"
+    # Serve paraphrases of answered questions without retrieval or LLM.
+    # Follow-ups depend on earlier turns, so only first turns are cached
+    use_cache = not conversation_history
+    cached = response_cache.lookup(query_embedding, request.model) if use_cache else None
+    if cached:
         return ChatResponse(
-            response=response_text,
-            sources=[],
-            confidence=0.0,
-            metadata={"reason": "low_retrieval_confidence"}
+            response=cached["response"],
+            sources=cached["sources"],
+            confidence=cached["confidence"],
+            metadata={
+                "model": request.model,
+                "cached": True
+            }
         )
     
+    # History compression may call the LLM; overlap it with retrieval
+    history_task = asyncio.create_task(compress_history(conversation_history, request.model))
+    try:
+        # Retrieve context
+        if retrieval_results is None:
+            retrieval_results = await retrieve_context(user_message, query_embedding)
+
+        if not retrieval_results or retrieval_results[0]['score'] < 0.7:
+            # Low confidence response
+            return ChatResponse(
+                response=LOW_CONFIDENCE_RESPONSE,
+                sources=[],
+                confidence=0.0,
+                metadata={"reason": "low_retrieval_confidence"}
+            )
+
+        history = await history_task
+    finally:
+        history_task.cancel()
+
     # Build and execute prompt
-    context = "\n\n".join([r['text'] for r in retrieval_results])
-    system_prompt = prompt_manager.get_system_prompt()
+    chunks = unique_chunks(retrieval_results)
+    context = build_context(chunks)
     final_prompt = prompt_manager.construct_prompt(
-        system=system_prompt,
+        system=SYSTEM_PROMPT,
         context=context,
-        conversation_history=conversation_history,
+        conversation_history=history,
         user_query=user_message
     )
     
     # Get LLM response
     response_text = await call_llm(final_prompt, request.model)
+    sources = chunk_sources(chunks)
+    
+    if use_cache and retrieval_cache.docs_version == docs_version:
+        response_cache.store(
+            query=user_message,
+            model=request.model,
+            embedding=query_embedding,
+            response=response_text,
+            sources=sources,
+            confidence=retrieval_results[0]['score']
+        )
     
     return ChatResponse(
         response=response_text,
-        sources=[r['metadata']['filename'] for r in retrieval_results],
+        sources=sources,
         confidence=retrieval_results[0]['score'],
         metadata={
             "model": request.model,
-            "chunks_used": len(retrieval_results)
+            "chunks_used": len(chunks)
         }
     )
 
@@ -247,6 +389,8 @@ async def delete_document(doc_id: str):
     """Delete a document and its embeddings"""
     success = await rag_engine.delete_document(doc_id)
     if success:
+        response_cache.clear()
+        retrieval_cache.invalidate()
         return {"status": "deleted", "document_id": doc_id}
     raise HTTPException(status_code=404, detail="Document not found")
 
@@ -258,19 +402,100 @@ async def get_stats():
         "total_requests": cost_logger.get_total_requests(),
         "total_cost": cost_logger.get_total_cost(),
         "avg_latency": cost_logger.get_avg_latency(),
+        "cache_hit_rate": response_cache.get_hit_rate(),
         "documents_indexed": rag_engine.get_document_count()
     }
 
 
 # Helper functions
+def sse_frame(payload: Dict[str, Any]) -> bytes:
+    """Encode a payload as an SSE data frame (bytes skip Starlette's re-encode)"""
+    # Scores from FAISS-backed engines arrive as numpy scalars
+    return b"data: " + orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n\n"
+
+
+async def embed_query(query: str, top_k: int = 5, confidence_threshold: float = 0.7):
+    """
+    Get the query embedding, plus retrieval results when this exact query
+    was retrieved recently against the current document set (else None)
+    """
+    entry = retrieval_cache.get(query, top_k, confidence_threshold)
+    if entry:
+        return entry["embedding"], entry["results"]
+    return await retrieval_batcher.embed(query), None
+
+
+async def retrieve_context(
+    query: str,
+    query_embedding,
+    top_k: int = 5,
+    confidence_threshold: float = 0.7
+) -> List[Dict[str, Any]]:
+    """Search for a query and remember the results for exact repeats"""
+    docs_version = retrieval_cache.docs_version
+    results = await retrieval_batcher.retrieve(
+        query=query,
+        query_embedding=query_embedding,
+        top_k=top_k,
+        confidence_threshold=confidence_threshold
+    )
+    retrieval_cache.put(query, top_k, confidence_threshold, query_embedding, results, docs_version)
+    return results
+
+
+def segment_id(result: Dict[str, Any]) -> str:
+    """Stable id for a retrieved chunk, derived from its text"""
+    return hashlib.blake2b(result['text'].encode('utf-8'), digest_size=8).hexdigest()
+
+
+def unique_chunks(retrieval_results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Retrieved chunks keyed by segment id, dropping exact duplicates"""
+    chunks = {}
+    for r in retrieval_results:
+        chunks.setdefault(segment_id(r), r)
+    return chunks
+
+
+def chunk_sources(chunks: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Filenames the chunks came from, each once, in retrieval order"""
+    return list(dict.fromkeys(r['metadata']['filename'] for r in chunks.values()))
+
+
+def context_tokens(chunks: Dict[str, Dict[str, Any]]) -> int:
+    """Total tokens across chunks, using counts stored at ingest when present"""
+    return sum(r.get('token_count') or count_tokens(r['text']) for r in chunks.values())
+
+
+def build_context(chunks: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Join retrieved chunks into segment-tagged context
+    Ordered by segment id rather than score so the same chunk set always
+    yields identical bytes, keeping provider prefix caches warm and letting
+    a self-hosted backend map each segment to precomputed KV state
+    """
+    return "\n\n".join(
+        f'<segment id="{seg_id}">{chunks[seg_id]["text"]}</segment>'
+        for seg_id in sorted(chunks)
+    )
+
+
 async def stream_llm_response(prompt: str, model: str):
     """Stream tokens from LLM (mock implementation)"""
     # In production, this would call actual LLM API
     response = f"Based on the provided documentation, here's what I found: {prompt[:100]}..."
-    
-    for char in response:
-        yield char
-        await asyncio.sleep(0.01)
+
+    # A real client's async token iterator drops in here
+    async for chunk in stream_text(response):
+        yield chunk
+
+
+async def stream_text(text: str):
+    """Stream already-generated text as batches of whole tokens"""
+    tokens = TOKEN_PATTERN.findall(text)
+    for i in range(0, len(tokens), STREAM_BATCH_TOKENS):
+        yield "".join(tokens[i:i + STREAM_BATCH_TOKENS])
+        # Cooperative yield so other requests progress between frames
+        await asyncio.sleep(0)
 
 
 async def call_llm(prompt: str, model: str) -> str:
@@ -278,12 +503,122 @@ async def call_llm(prompt: str, model: str) -> str:
     return f"Response based on: {prompt[:200]}..."
 
 
+async def compress_history(
+    history: List[Message],
+    model: str,
+    max_tokens: int = MAX_HISTORY_TOKENS,
+    keep_recent: int = HISTORY_KEEP_RECENT
+) -> List[Message]:
+    """
+    Fit conversation history into a token budget
+    Trims from the middle, not the front: the first turn and the most recent
+    turns that fit stay verbatim, the rest becomes one summary note. A note
+    is reused on later turns while what follows it still fits, so the
+    leading prompt bytes stay stable for prefix caching
+    """
+    # Token counting is CPU work; keep it off the event loop
+    plan = await asyncio.to_thread(select_history, history, max_tokens, keep_recent)
+    if plan is None:
+        return history
+    
+    head, middle, tail, prefix_key = plan
+    if not middle:
+        return [*head, *tail]
+    
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in middle)
+    summary = await asyncio.to_thread(
+        truncate_tokens,
+        "Summary of earlier conversation: " + await summarize_context(transcript, model),
+        max_tokens // 4
+    )
+    history_summaries.put(prefix_key, summary)
+    
+    return [*head, Message(role="system", content=summary), *tail]
+
+
+def select_history(
+    history: List[Message],
+    max_tokens: int,
+    keep_recent: int
+) -> Optional[Tuple[List[Message], List[Message], List[Message], str]]:
+    """
+    Decide what compress_history keeps, without calling the LLM
+    Returns (head, middle, tail, prefix_key), or None if history already
+    fits: head is the truncated first turn plus any reusable summary note,
+    middle the turns still to summarize, and prefix_key the cache key for
+    the conversation up to the end of middle
+    """
+    if sum(count_tokens(m.content) for m in history) <= max_tokens:
+        return None
+    
+    # The first turn and the summary note each get at most a quarter
+    share = max_tokens // 4
+    first = Message(role=history[0].role, content=truncate_tokens(history[0].content, share))
+    rest = history[1:]
+    budget = max_tokens - count_tokens(first.content)
+    prefix_keys = history_prefix_keys(history)
+    
+    # Reuse the note for the longest already-summarized prefix
+    for end in range(len(rest), 0, -1):
+        summary = history_summaries.get(prefix_keys[end])
+        if summary is None:
+            continue
+        tail = fit_recent(rest[end:], budget - count_tokens(summary))
+        if len(tail) == len(rest) - end:
+            return [first, Message(role="system", content=summary)], [], tail, prefix_keys[end]
+        break
+    
+    # Keep as many recent turns as fit beside the note
+    tail = fit_recent(rest[-keep_recent:] if keep_recent else [], budget - share)
+    middle = rest[:len(rest) - len(tail)]
+    return [first], middle, tail, prefix_keys[len(middle)]
+
+
+def fit_recent(turns: List[Message], budget: int) -> List[Message]:
+    """Most recent turns within budget; the newest is truncated rather than dropped"""
+    tail = []
+    used = 0
+    for m in reversed(turns):
+        tokens = count_tokens(m.content)
+        if used + tokens > budget:
+            if not tail and budget > 0:
+                tail.append(Message(role=m.role, content=truncate_tokens(m.content, budget)))
+            break
+        tail.insert(0, m)
+        used += tokens
+    return tail
+
+
+def history_prefix_keys(history: List[Message]) -> List[str]:
+    """Key for each prefix history[:n + 1], n = 0..len(history) - 1"""
+    digest = hashlib.blake2b(digest_size=16)
+    keys = []
+    for m in history:
+        digest.update(orjson.dumps([m.role, m.content]))
+        keys.append(digest.hexdigest())
+    return keys
+
+
 async def summarize_context(context: str, model: str) -> str:
     """Summarize context if too large"""
-    summary_prompt = f"Summarize the following context concisely:\n\n{context}"
-    return await call_llm(summary_prompt, model)
+    return await call_llm(SUMMARY_PROMPT_PREFIX + context, model)
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    
+    # One worker by default: the vector index, caches and stats live in
+    # process memory, so uploads, deletions and cache invalidation only
+    # reach the worker that handled them. WEB_CONCURRENCY opts into more
+    # workers once that state is shared; those need the app as an import
+    # string, while one worker serves this module's app without importing
+    # it a second time. The loop and HTTP parser stay on "auto", picking
+    # uvloop and httptools when installed (uvicorn[standard])
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        f"{os.path.splitext(os.path.basename(__file__))[0]}:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        workers=workers
+    )
@@ -1,9 +1,22 @@
 # cost_logger.py - Cost Tracking and Performance Monitoring
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict, deque
 from datetime import datetime
-import json
+import asyncio
+import logging
+import mmap
+import os
+import threading
+import time
 import uuid
 
+import numpy as np
+import orjson
+
+from token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
 
 class CostLogger:
     """
@@ -31,16 +44,46 @@ class CostLogger:
         }
     }
     
+    # PRICING flattened to per-token rates for the per-request cost math
+    _INPUT_PER_TOKEN = {model: p["input"] / 1000 for model, p in PRICING.items()}
+    _OUTPUT_PER_TOKEN = {model: p["output"] / 1000 for model, p in PRICING.items()}
+    
+    # Provider prompt caching, relative to the model's input price
+    CACHE_WRITE_MULTIPLIER = 1.25  # cache_creation_input_tokens
+    CACHE_READ_MULTIPLIER = 0.1    # cache_read_input_tokens
+    
+    # Background log writer: flush every N entries or T seconds
+    FLUSH_BATCH_SIZE = 100
+    FLUSH_INTERVAL_SECONDS = 0.25
+    
+    # Recent latencies kept for percentiles; totals cover the whole session
+    LATENCY_WINDOW = 10000
+    
+    # Requests started but never ended are dropped past these bounds
+    MAX_ACTIVE_REQUESTS = 10000
+    ACTIVE_REQUEST_TTL_SECONDS = 3600
+    
     def __init__(self, log_file: str = "cost_logs.jsonl"):
         self.log_file = log_file
-        self.active_requests = {}
+        self.active_requests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self.session_stats = {
             "total_requests": 0,
             "total_cost": 0.0,
             "total_tokens": 0,
-            "latencies": [],
+            "latencies": deque(maxlen=self.LATENCY_WINDOW),
+            "latency_sum": 0.0,
+            "latency_min": None,
+            "latency_max": None,
             "errors": 0
         }
+        self._requests_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._pending_logs: List[bytes] = []
+        self._pending_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self._writer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_requested: Optional[asyncio.Event] = None
         
     def start_request(
         self,
@@ -48,19 +91,24 @@ class CostLogger:
         input_text: str,
         request_type: str = "completion"
     ) -> str:
-        """Start tracking a request"""
+        """
+        Start tracking a request
+        Input tokens are counted in end_request, which callers can run off
+        the event loop
+        """
         request_id = str(uuid.uuid4())
         
-        input_tokens = self._estimate_tokens(input_text)
-        
-        self.active_requests[request_id] = {
-            "id": request_id,
-            "model": model,
-            "request_type": request_type,
-            "input_tokens": input_tokens,
-            "start_time": datetime.now(),
-            "input_text_preview": input_text[:200]
-        }
+        # end_request may run in worker threads
+        with self._requests_lock:
+            self.active_requests[request_id] = {
+                "id": request_id,
+                "model": model,
+                "request_type": request_type,
+                "input_text": input_text,
+                "start_ns": time.perf_counter_ns(),
+                "input_text_preview": input_text[:200]
+            }
+            self._evict_stale_requests()
         
         return request_id
     
@@ -69,78 +117,172 @@ class CostLogger:
         request_id: str,
         output_text: str,
         success: bool = True,
-        error: Optional[str] = None
+        error: Optional[str] = None,
+        cache_creation_input_tokens: int = 0,
+        cache_read_input_tokens: int = 0
     ):
-        """End tracking a request and calculate costs"""
-        if request_id not in self.active_requests:
+        """
+        End tracking a request and calculate costs
+        Cache token counts come from the provider's usage block when
+        prompt caching is enabled
+        """
+        with self._requests_lock:
+            request_data = self.active_requests.pop(request_id, None)
+        if request_data is None:
             return
         
-        request_data = self.active_requests[request_id]
-        end_time = datetime.now()
-        latency = (end_time - request_data["start_time"]).total_seconds()
+        latency = (time.perf_counter_ns() - request_data["start_ns"]) / 1e9
         
+        input_tokens = self._estimate_tokens(request_data["input_text"])
         output_tokens = self._estimate_tokens(output_text)
         
         # Calculate cost
         model = request_data["model"]
-        pricing = self.PRICING.get(model, {"input": 0, "output": 0})
+        input_rate = self._INPUT_PER_TOKEN.get(model, 0.0)
         
-        input_cost = (request_data["input_tokens"] / 1000) * pricing["input"]
-        output_cost = (output_tokens / 1000) * pricing["output"]
-        total_cost = input_cost + output_cost
+        input_cost = input_tokens * input_rate
+        output_cost = output_tokens * self._OUTPUT_PER_TOKEN.get(model, 0.0)
+        cache_cost = input_rate * (
+            cache_creation_input_tokens * self.CACHE_WRITE_MULTIPLIER
+            + cache_read_input_tokens * self.CACHE_READ_MULTIPLIER
+        )
+        total_cost = input_cost + output_cost + cache_cost
         
         # Build log entry
         log_entry = {
             "request_id": request_id,
-            "timestamp": end_time.isoformat(),
+            "timestamp": datetime.now().isoformat(),
             "model": model,
             "request_type": request_data["request_type"],
-            "input_tokens": request_data["input_tokens"],
+            "input_tokens": input_tokens,
             "output_tokens": output_tokens,
-            "total_tokens": request_data["input_tokens"] + output_tokens,
+            "cache_creation_input_tokens": cache_creation_input_tokens,
+            "cache_read_input_tokens": cache_read_input_tokens,
+            "total_tokens": (
+                input_tokens + output_tokens
+                + cache_creation_input_tokens + cache_read_input_tokens
+            ),
             "input_cost": round(input_cost, 6),
             "output_cost": round(output_cost, 6),
+            "cache_cost": round(cache_cost, 6),
             "total_cost": round(total_cost, 6),
             "latency_seconds": round(latency, 3),
             "success": success,
             "error": error
         }
         
-        # Update session stats
-        self.session_stats["total_requests"] += 1
-        self.session_stats["total_cost"] += total_cost
-        self.session_stats["total_tokens"] += log_entry["total_tokens"]
-        self.session_stats["latencies"].append(latency)
-        if not success:
-            self.session_stats["errors"] += 1
+        # Update session stats (end_request may run in worker threads)
+        with self._stats_lock:
+            self.session_stats["total_requests"] += 1
+            self.session_stats["total_cost"] += total_cost
+            self.session_stats["total_tokens"] += log_entry["total_tokens"]
+            self.session_stats["latencies"].append(latency)
+            self.session_stats["latency_sum"] += latency
+            if self.session_stats["latency_min"] is None or latency < self.session_stats["latency_min"]:
+                self.session_stats["latency_min"] = latency
+            if self.session_stats["latency_max"] is None or latency > self.session_stats["latency_max"]:
+                self.session_stats["latency_max"] = latency
+            if not success:
+                self.session_stats["errors"] += 1
         
         # Write to log file
         self._write_log(log_entry)
         
-        # Clean up
-        del self.active_requests[request_id]
-        
         return log_entry
     
-    def _estimate_tokens(self, text: str) -> int:
+    def _evict_stale_requests(self):
         """
-        Estimate token count
-        Rule of thumb: ~4 chars per token for English
-        In production, use tiktoken or similar
+        Drop abandoned requests (oldest first) beyond the size or age bound
+        Called with _requests_lock held
         """
-        return len(text) // 4
+        cutoff_ns = time.perf_counter_ns() - self.ACTIVE_REQUEST_TTL_SECONDS * 1_000_000_000
+        while self.active_requests:
+            oldest = next(iter(self.active_requests.values()))
+            if len(self.active_requests) <= self.MAX_ACTIVE_REQUESTS and oldest["start_ns"] >= cutoff_ns:
+                break
+            self.active_requests.popitem(last=False)
+    
+    def _estimate_tokens(self, text: str) -> int:
+        """Count tokens (cl100k_base; approximate for non-OpenAI models)"""
+        return count_tokens(text)
     
     def _write_log(self, entry: Dict[str, Any]):
-        """Append log entry to file"""
-        with open(self.log_file, 'a') as f:
-            f.write(json.dumps(entry) + '\n')
+        """
+        Queue log entry for the background writer
+        Without a running writer (scripts, one-off analysis) entries are
+        written through immediately
+        """
+        line = orjson.dumps(entry) + b"\n"
+        with self._pending_lock:
+            self._pending_logs.append(line)
+            pending = len(self._pending_logs)
+        
+        if self._writer is None or self._writer.done():
+            self.flush()
+        elif pending >= self.FLUSH_BATCH_SIZE:
+            self._writer_loop.call_soon_threadsafe(self._flush_requested.set)
+    
+    def flush(self):
+        """Write all queued log entries to file"""
+        with self._pending_lock:
+            batch, self._pending_logs = self._pending_logs, []
+        
+        if not batch:
+            return
+        
+        # One unbuffered O_APPEND write per batch keeps lines whole when
+        # several server workers share the log file
+        with self._file_lock:
+            with open(self.log_file, 'ab', buffering=0) as f:
+                f.write(b"".join(batch))
+    
+    def start_writer(self):
+        """Start batched log writing on the running event loop"""
+        if self._writer is not None and not self._writer.done():
+            return
+        self._writer_loop = asyncio.get_running_loop()
+        self._flush_requested = asyncio.Event()
+        self._writer = asyncio.create_task(self._flush_periodically())
+    
+    async def stop_writer(self):
+        """Stop the background writer and flush what is left"""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        self._flush_logged()
+    
+    async def _flush_periodically(self):
+        """Flush queued entries off the event loop"""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(),
+                    timeout=self.FLUSH_INTERVAL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await asyncio.to_thread(self._flush_logged)
+    
+    def _flush_logged(self):
+        """Flush, logging failures instead of raising (the batch is dropped)"""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write cost log entries to %s", self.log_file)
     
     def get_request_time(self, request_id: str) -> str:
         """Get formatted processing time for active request"""
-        if request_id not in self.active_requests:
+        with self._requests_lock:
+            request_data = self.active_requests.get(request_id)
+        if request_data is None:
             return "0.0s"
         
-        elapsed = (datetime.now() - self.active_requests[request_id]["start_time"]).total_seconds()
+        elapsed = (time.perf_counter_ns() - request_data["start_ns"]) / 1e9
         return f"{elapsed:.1f}s"
     
     def get_total_requests(self) -> int:
@@ -153,13 +295,14 @@ class CostLogger:
     
     def get_avg_latency(self) -> float:
         """Get average latency in session"""
-        if not self.session_stats["latencies"]:
+        if not self.session_stats["total_requests"]:
             return 0.0
-        return round(sum(self.session_stats["latencies"]) / len(self.session_stats["latencies"]), 3)
+        return round(self.session_stats["latency_sum"] / self.session_stats["total_requests"], 3)
     
     def get_session_stats(self) -> Dict[str, Any]:
         """Get comprehensive session statistics"""
-        latencies = self.session_stats["latencies"]
+        with self._stats_lock:
+            latencies = list(self.session_stats["latencies"])
         
         return {
             "total_requests": self.session_stats["total_requests"],
@@ -168,19 +311,18 @@ class CostLogger:
             "total_cost_usd": round(self.session_stats["total_cost"], 4),
             "total_tokens": self.session_stats["total_tokens"],
             "avg_latency_seconds": self.get_avg_latency(),
-            "min_latency_seconds": round(min(latencies), 3) if latencies else 0,
-            "max_latency_seconds": round(max(latencies), 3) if latencies else 0,
+            "min_latency_seconds": round(self.session_stats["latency_min"], 3) if latencies else 0,
+            "max_latency_seconds": round(self.session_stats["latency_max"], 3) if latencies else 0,
             "p95_latency_seconds": round(self._percentile(latencies, 95), 3) if latencies else 0,
             "error_rate": round(self.session_stats["errors"] / max(self.session_stats["total_requests"], 1), 4)
         }
     
-    def _percentile(self, data: list, percentile: int) -> float:
-        """Calculate percentile"""
+    def _percentile(self, data, percentile: int) -> float:
+        """Calculate percentile (selection via NumPy, no full sort)"""
         if not data:
             return 0.0
-        sorted_data = sorted(data)
-        idx = int(len(sorted_data) * (percentile / 100))
-        return sorted_data[min(idx, len(sorted_data) - 1)]
+        values = np.fromiter(data, dtype=np.float64, count=len(data))
+        return float(np.percentile(values, percentile))
     
     def analyze_costs(
         self,
@@ -190,45 +332,46 @@ class CostLogger:
         Analyze costs over time window
         Useful for budget tracking and optimization
         """
-        # Read all logs
-        logs = []
-        try:
-            with open(self.log_file, 'r') as f:
-                for line in f:
-                    logs.append(json.loads(line))
-        except FileNotFoundError:
-            return {"error": "No logs found"}
-        
-        if not logs:
-            return {"error": "No logs to analyze"}
+        # Include entries still queued for the writer
+        self.flush()
         
-        # Aggregate by model
+        # Aggregate by model in one pass over the memory-mapped log
         by_model = {}
         total_cost = 0
         total_requests = 0
         
-        for log in logs:
-            model = log["model"]
-            if model not in by_model:
-                by_model[model] = {
-                    "requests": 0,
-                    "cost": 0,
-                    "tokens": 0,
-                    "avg_latency": []
-                }
-            
-            by_model[model]["requests"] += 1
-            by_model[model]["cost"] += log["total_cost"]
-            by_model[model]["tokens"] += log["total_tokens"]
-            by_model[model]["avg_latency"].append(log["latency_seconds"])
-            
-            total_cost += log["total_cost"]
-            total_requests += 1
+        try:
+            with open(self.log_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return {"error": "No logs to analyze"}
+                
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for line in iter(mm.readline, b""):
+                        if not line.strip():
+                            continue
+                        log = orjson.loads(line)
+                        
+                        model = log["model"]
+                        if model not in by_model:
+                            by_model[model] = {
+                                "requests": 0,
+                                "cost": 0,
+                                "tokens": 0,
+                                "latency_sum": 0
+                            }
+                        
+                        by_model[model]["requests"] += 1
+                        by_model[model]["cost"] += log["total_cost"]
+                        by_model[model]["tokens"] += log["total_tokens"]
+                        by_model[model]["latency_sum"] += log["latency_seconds"]
+                        
+                        total_cost += log["total_cost"]
+                        total_requests += 1
+        except FileNotFoundError:
+            return {"error": "No logs found"}
         
-        # Calculate averages
-        for model in by_model:
-            latencies = by_model[model]["avg_latency"]
-            by_model[model]["avg_latency"] = sum(latencies) / len(latencies)
+        if not total_requests:
+            return {"error": "No logs to analyze"}
         
         return {
             "total_cost": round(total_cost, 4),
@@ -239,7 +382,7 @@ class CostLogger:
                     "total_cost": round(data["cost"], 4),
                     "avg_cost_per_request": round(data["cost"] / data["requests"], 6),
                     "total_tokens": data["tokens"],
-                    "avg_latency": round(data["avg_latency"], 3)
+                    "avg_latency": round(data["latency_sum"] / data["requests"], 3)
                 }
                 for model, data in by_model.items()
             }
@@ -69,6 +69,15 @@ MAX_CONTEXT_SIZE=4000
 BACKEND_HOST=0.0.0.0
 BACKEND_PORT=8000
 
+# Server worker processes (default 1). Only raise this once the vector
+# index and caches are shared: each worker keeps its own in memory, so
+# uploads, deletions and cache invalidation reach one worker only
+# WEB_CONCURRENCY=1
+
+# Token counting loads tiktoken's cl100k_base file, downloading it on first
+# use. Offline hosts: point this at a directory pre-seeded with that file
+# TIKTOKEN_CACHE_DIR=/var/cache/tiktoken
+
 # Frontend URL (for CORS)
 FRONTEND_URL=http://localhost:3000
 
@@ -0,0 +1,38 @@
+# query_embedder.py - Batched Query Embeddings
+from typing import List
+import asyncio
+
+from openai import AsyncOpenAI
+
+
+class QueryEmbedder:
+    """
+    Embeds batches of queries with the configured embedding model
+    OpenAI models go through the async client, one request per batch;
+    sentence-transformers/* models run locally in a worker thread
+    """
+
+    LOCAL_PREFIX = "sentence-transformers/"
+
+    def __init__(self, model: str = "text-embedding-ada-002"):
+        self.model = model
+
+        # Built here so a missing API key or package fails at startup,
+        # not on the first chat request
+        if model.startswith(self.LOCAL_PREFIX):
+            # Optional dependency; pulls in torch
+            from sentence_transformers import SentenceTransformer
+            self._local = SentenceTransformer(model)
+            self._client = None
+        else:
+            self._local = None
+            self._client = AsyncOpenAI()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in one call, returned in input order"""
+        if self._local is not None:
+            vectors = await asyncio.to_thread(self._local.encode, texts)
+            return [vector.tolist() for vector in vectors]
+
+        response = await self._client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
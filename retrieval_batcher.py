@@ -0,0 +1,195 @@
+# retrieval_batcher.py - Micro-batching for Concurrent Retrievals
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Set, Tuple
+import asyncio
+
+
+class _BatchLane:
+    """
+    Queue drained by one background task in windowed batches
+    Each queued item ends with the future its caller is waiting on; batches
+    are dispatched as their own tasks so collection never waits on a call
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[Tuple]], Awaitable[None]],
+        window_seconds: float,
+        max_batch_size: int,
+        max_in_flight: int
+    ):
+        self.process = process
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    async def submit(self, *args):
+        """Queue one item and wait for its batch to resolve it"""
+        if self._worker is None or self._worker.done():
+            self.queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((*args, future))
+        return await future
+
+    async def close(self):
+        """Stop the background task, failing every caller still waiting"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        in_flight = list(self._in_flight)
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+        # Queued items no batch ever picked up
+        while self.queue is not None and not self.queue.empty():
+            _fail([self.queue.get_nowait()], _closed_error())
+
+    async def _run(self):
+        """Collect items for one window, then process them together"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window_seconds
+
+            try:
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                # Bounds concurrent calls; while all slots are busy the queue
+                # keeps filling, so the next batch comes out larger
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                _fail(batch, _closed_error())
+                raise
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[Tuple]):
+        """Process one batch, failing its callers on error"""
+        try:
+            await self.process(batch)
+        except asyncio.CancelledError:
+            _fail(batch, _closed_error())
+            raise
+        except Exception as e:
+            _fail(batch, e)
+        finally:
+            self._slots.release()
+
+
+class RetrievalBatcher:
+    """
+    Coalesces concurrent retrievals into batched embedding and search calls
+    Queries arriving within a short window are embedded with one embedder
+    call and, when the engine offers retrieve_batch, searched with one call,
+    amortizing per-call overhead (API round trips, kernel launches on GPU
+    indexes). Other engines get the plain retrieve(query, top_k,
+    confidence_threshold) call, unbatched
+    """
+
+    def __init__(
+        self,
+        rag_engine,
+        embedder,
+        window_ms: float = 5.0,
+        max_batch_size: int = 64,
+        max_in_flight: int = 8
+    ):
+        self.rag_engine = rag_engine
+        self.embedder = embedder
+        self._can_batch = callable(getattr(rag_engine, "retrieve_batch", None))
+        self._embed_lane = _BatchLane(
+            self._embed_batch, window_ms / 1000, max_batch_size, max_in_flight
+        )
+        self._search_lane = _BatchLane(
+            self._search_batch, window_ms / 1000, max_batch_size, max_in_flight
+        )
+
+    async def embed(self, query: str):
+        """Get the query embedding, batched with concurrent callers"""
+        return await self._embed_lane.submit(query)
+
+    async def retrieve(
+        self,
+        query: str,
+        query_embedding,
+        top_k: int = 5,
+        confidence_threshold: float = 0.7
+    ) -> List[Dict[str, Any]]:
+        """Search for a query, batched with concurrent callers where the engine allows"""
+        if not self._can_batch:
+            return await self.rag_engine.retrieve(
+                query=query,
+                top_k=top_k,
+                confidence_threshold=confidence_threshold
+            )
+        return await self._search_lane.submit(query, query_embedding, top_k, confidence_threshold)
+
+    async def close(self):
+        """Stop the background batching tasks"""
+        await self._embed_lane.close()
+        await self._search_lane.close()
+
+    async def _embed_batch(self, batch: List[Tuple]):
+        """Embed each distinct query in the batch once"""
+        queries = list(dict.fromkeys(item[0] for item in batch))
+        vectors = await self.embedder.embed(queries)
+        by_query = dict(zip(queries, vectors, strict=True))
+
+        for query, future in batch:
+            if not future.done():
+                future.set_result(by_query[query])
+
+    async def _search_batch(self, batch: List[Tuple]):
+        """Run one search per (top_k, threshold) group"""
+        groups: Dict[Tuple[int, float], List[Tuple]] = {}
+        for item in batch:
+            groups.setdefault((item[2], item[3]), []).append(item)
+
+        for (top_k, confidence_threshold), items in groups.items():
+            try:
+                results = await self.rag_engine.retrieve_batch(
+                    queries=[item[0] for item in items],
+                    query_embeddings=[item[1] for item in items],
+                    top_k=top_k,
+                    confidence_threshold=confidence_threshold
+                )
+
+                # strict: a short result list must fail the leftover callers
+                # rather than leave them waiting forever
+                for item, result in zip(items, results, strict=True):
+                    if not item[-1].done():
+                        item[-1].set_result(result)
+            except Exception as e:
+                _fail(items, e)
+
+
+def _closed_error() -> RuntimeError:
+    return RuntimeError("Retrieval batcher closed")
+
+
+def _fail(items: List[Tuple], error: Exception):
+    """Propagate a batch failure to every caller still waiting"""
+    for item in items:
+        if not item[-1].done():
+            item[-1].set_exception(error)
@@ -0,0 +1,69 @@
+# retrieval_cache.py - Exact-Match Retrieval Cache
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+import time
+
+
+class RetrievalCache:
+    """
+    Memoizes query embeddings and retrieval results for repeated queries
+    Keys carry a document-set version, so uploads and deletions invalidate
+    earlier entries without scanning the cache
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: int = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self.docs_version = 0
+
+    def get(
+        self,
+        query: str,
+        top_k: int,
+        confidence_threshold: float
+    ) -> Optional[Dict[str, Any]]:
+        """Return the cached embedding and results, if fresh"""
+        key = (query, top_k, confidence_threshold, self.docs_version)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if time.time() - entry["ts"] > self.ttl_seconds:
+            self.entries.pop(key, None)
+            return None
+
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(
+        self,
+        query: str,
+        top_k: int,
+        confidence_threshold: float,
+        embedding,
+        results: List[Dict[str, Any]],
+        docs_version: int
+    ):
+        """
+        Cache the embedding and results for a query
+        docs_version is the version read before the search started; results
+        from a search that raced an invalidation are dropped
+        """
+        if docs_version != self.docs_version:
+            return
+
+        key = (query, top_k, confidence_threshold, docs_version)
+        self.entries[key] = {
+            "embedding": embedding,
+            "results": results,
+            "ts": time.time()
+        }
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """Mark the document set as changed"""
+        self.docs_version += 1
@@ -0,0 +1,118 @@
+# semantic_cache.py - Semantic Response Cache
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+import time
+
+import faiss
+import numpy as np
+
+
+class SemanticResponseCache:
+    """
+    Serves stored answers for questions similar to ones already answered
+    Queries are matched by cosine similarity of their embeddings (FAISS
+    inner product over normalized vectors), with LRU eviction and a TTL
+    Entries are partitioned by model, so an answer is only served back to
+    requests for the model that generated it
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.92,
+        ttl_seconds: int = 3600,
+        max_entries: int = 1024
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.ids_by_query: Dict[Tuple[str, str], int] = {}
+        self.indexes: Dict[str, Any] = {}  # Per model, built on first store
+        self._next_id = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0
+        }
+
+    def lookup(self, embedding, model: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for the closest past query, if close and fresh enough"""
+        index = self.indexes.get(model)
+        if index is None or index.ntotal == 0:
+            self.stats["misses"] += 1
+            return None
+
+        scores, ids = index.search(self._normalize(embedding), 1)
+        entry_id = int(ids[0][0])
+
+        if entry_id == -1 or scores[0][0] < self.similarity_threshold:
+            self.stats["misses"] += 1
+            return None
+
+        entry = self.entries[entry_id]
+        if time.time() - entry["ts"] > self.ttl_seconds:
+            self._evict(entry_id)
+            self.stats["misses"] += 1
+            return None
+
+        self.entries.move_to_end(entry_id)
+        self.stats["hits"] += 1
+        return entry
+
+    def store(
+        self,
+        query: str,
+        model: str,
+        embedding,
+        response: str,
+        sources: List[str],
+        confidence: float
+    ):
+        """Cache a response under the query that produced it"""
+        vector = self._normalize(embedding)
+
+        if model not in self.indexes:
+            self.indexes[model] = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+
+        # Same question asked again replaces the older answer
+        if (model, query) in self.ids_by_query:
+            self._evict(self.ids_by_query[(model, query)])
+
+        entry_id = self._next_id
+        self._next_id += 1
+
+        self.indexes[model].add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+        self.entries[entry_id] = {
+            "query": query,
+            "model": model,
+            "response": response,
+            "sources": sources,
+            "confidence": confidence,
+            "ts": time.time()
+        }
+        self.ids_by_query[(model, query)] = entry_id
+
+        while len(self.entries) > self.max_entries:
+            self._evict(next(iter(self.entries)))
+
+    def clear(self):
+        """Drop all entries (e.g. after the document set changes)"""
+        self.entries.clear()
+        self.ids_by_query.clear()
+        self.indexes.clear()
+
+    def get_hit_rate(self) -> float:
+        """Get fraction of lookups served from cache"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return round(self.stats["hits"] / max(lookups, 1), 4)
+
+    def _evict(self, entry_id: int):
+        """Remove one entry from both the index and the entry store"""
+        entry = self.entries.pop(entry_id)
+        self.ids_by_query.pop((entry["model"], entry["query"]), None)
+        self.indexes[entry["model"]].remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def _normalize(self, embedding) -> np.ndarray:
+        """L2-normalize so inner product equals cosine similarity"""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return vector
@@ -0,0 +1,36 @@
+# summary_cache.py - Conversation Summary Cache
+from typing import Optional
+from collections import OrderedDict
+import threading
+
+
+class SummaryCache:
+    """
+    Remembers the summary note written for each conversation prefix
+    Later turns of the same conversation reuse the note instead of
+    re-summarizing, so the leading prompt bytes stay stable for prefix
+    caching; least recently used prefixes are evicted first. Thread-safe,
+    as history selection runs in worker threads
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prefix_key: str) -> Optional[str]:
+        """Return the note for a conversation prefix, if one was written"""
+        with self._lock:
+            summary = self.entries.get(prefix_key)
+            if summary is not None:
+                self.entries.move_to_end(prefix_key)
+            return summary
+
+    def put(self, prefix_key: str, summary: str):
+        """Remember the note written for a conversation prefix"""
+        with self._lock:
+            self.entries[prefix_key] = summary
+            self.entries.move_to_end(prefix_key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,56 @@
+# token_counter.py - Token Counting Helpers
+from functools import lru_cache
+import logging
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_encoder():
+    """
+    Load the cl100k_base encoder once, or None if it cannot be loaded
+    cl100k_base is exact for GPT-4 and a close proxy for Claude models.
+    tiktoken downloads its BPE file on first load (offline hosts need
+    TIKTOKEN_CACHE_DIR pre-seeded); without it counts fall back to len // 4
+    """
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning(
+            "Could not load the tiktoken cl100k_base encoding; estimating "
+            "tokens as len(text) // 4. Set TIKTOKEN_CACHE_DIR to a directory "
+            "pre-seeded with its BPE file on offline hosts",
+            exc_info=True
+        )
+        return None
+
+
+# Texts up to this length are memoized (queries, short replies)
+_MEMOIZE_MAX_CHARS = 2048
+
+
+@lru_cache(maxsize=8192)
+def _count_tokens_cached(text: str) -> int:
+    return len(get_encoder().encode_ordinary(text))
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken's BPE encoder"""
+    if get_encoder() is None:
+        return len(text) // 4
+    if len(text) <= _MEMOIZE_MAX_CHARS:
+        return _count_tokens_cached(text)
+    return len(get_encoder().encode_ordinary(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens"""
+    enc = get_encoder()
+    if enc is None:
+        return text[:max_tokens * 4]
+    tokens = enc.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens])